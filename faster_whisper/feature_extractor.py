@@ -73,52 +73,28 @@ class FeatureExtractor:
 
     def fram_wave(self, waveform, center=True):
         """
-        Transform a raw waveform into a list of smaller waveforms.
+        Transform a raw waveform into an array of smaller waveforms.
         The window length defines how much of the signal is
         contain in each frame (smalle waveform), while the hope length defines the step
         between the beginning of each new frame.
         Centering is done by reflecting the waveform which is first centered around
         `frame_idx * hop_length`.
+        The frames are returned as a strided view of the (padded) waveform.
         """
-        frames = []
-        for i in range(0, waveform.shape[0] + 1, self.hop_length):
+        if center:
             half_window = (self.n_fft - 1) // 2 + 1
-            if center:
-                start = i - half_window if i > half_window else 0
-                end = (
-                    i + half_window
-                    if i < waveform.shape[0] - half_window
-                    else waveform.shape[0]
-                )
-
-                frame = waveform[start:end]
-
-                if start == 0:
-                    padd_width = (-i + half_window, 0)
-                    frame = np.pad(frame, pad_width=padd_width, mode="reflect")
-
-                elif end == waveform.shape[0]:
-                    padd_width = (0, (i - waveform.shape[0] + half_window))
-                    frame = np.pad(frame, pad_width=padd_width, mode="reflect")
-
-            else:
-                frame = waveform[i : i + self.n_fft]
-                frame_width = frame.shape[0]
-                if frame_width < waveform.shape[0]:
-                    frame = np.lib.pad(
-                        frame,
-                        pad_width=(0, self.n_fft - frame_width),
-                        mode="constant",
-                        constant_values=0,
-                    )
-
-            frames.append(frame)
-        return np.stack(frames, 0)
-
-    def stft(self, frames, window):
+            waveform = np.pad(waveform, (half_window, half_window), mode="reflect")
+        else:
+            waveform = np.pad(waveform, (0, self.n_fft))
+
+        frames = np.lib.stride_tricks.sliding_window_view(waveform, self.n_fft)
+        return frames[:: self.hop_length]
+
+    def stft(self, frames, window, block_size=1024):
         """
         Calculates the complex Short-Time Fourier Transform (STFT) of the given framed signal.
         Should give the same results as `torch.stft`.
+        The FFT is computed on blocks of frames to bound the memory usage.
         """
         frame_size = frames.shape[1]
         fft_size = self.n_fft
@@ -132,14 +108,12 @@ class FeatureExtractor:
         num_fft_bins = (fft_size >> 1) + 1
 
         data = np.empty((len(frames), num_fft_bins), dtype=np.complex64)
-        fft_signal = np.zeros(fft_size)
 
-        for f, frame in enumerate(frames):
+        for start in range(0, len(frames), block_size):
+            block = frames[start : start + block_size]
             if window is not None:
-                np.multiply(frame, window, out=fft_signal[:frame_size])
-            else:
-                fft_signal[:frame_size] = frame
-            data[f] = np.fft.fft(fft_signal, axis=0)[:num_fft_bins]
+                block = block * window
+            data[start : start + block_size] = np.fft.rfft(block, n=fft_size, axis=-1)
         return data.T
 
     def __call__(self, waveform, padding=True):
@@ -67,3 +67,9 @@ class Tokenizer:
     def decode(self, tokens: List[int]) -> str:
         text_tokens = [token for token in tokens if token < self.eot]
         return self.tokenizer.decode(text_tokens)
+
+    def decode_batch(self, batch_tokens: List[List[int]]) -> List[str]:
+        batch_text_tokens = [
+            [token for token in tokens if token < self.eot] for tokens in batch_tokens
+        ]
+        return self.tokenizer.decode_batch(batch_text_tokens)
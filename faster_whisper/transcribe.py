@@ -1,8 +1,10 @@
 import collections
+import concurrent.futures
+import dataclasses
 import os
 import zlib
 
-from typing import BinaryIO, List, Optional, Tuple, Union
+from typing import BinaryIO, List, Optional, Sequence, Tuple, Union
 
 import ctranslate2
 import numpy as np
@@ -23,29 +25,52 @@ class AudioInfo(
     pass
 
 
-class TranscriptionOptions(
-    collections.namedtuple(
-        "TranscriptionOptions",
-        (
-            "beam_size",
-            "best_of",
-            "patience",
-            "length_penalty",
-            "log_prob_threshold",
-            "no_speech_threshold",
-            "compression_ratio_threshold",
-            "condition_on_previous_text",
-            "temperatures",
-            "initial_prompt",
-            "prefix",
-            "suppress_blank",
-            "suppress_tokens",
-            "without_timestamps",
-            "max_initial_timestamp",
-        ),
+@dataclasses.dataclass(frozen=True)
+class TranscriptionOptions:
+    # The options are read for each window so the fields are stored in slots.
+    # The slots must be kept in sync with the field annotations below.
+    __slots__ = (
+        "beam_size",
+        "best_of",
+        "patience",
+        "length_penalty",
+        "log_prob_threshold",
+        "no_speech_threshold",
+        "compression_ratio_threshold",
+        "condition_on_previous_text",
+        "temperatures",
+        "initial_prompt",
+        "prefix",
+        "suppress_blank",
+        "suppress_tokens",
+        "without_timestamps",
+        "max_initial_timestamp",
     )
-):
-    pass
+
+    # The fields must be kept in sync with __slots__ above.
+    beam_size: int
+    best_of: int
+    patience: float
+    length_penalty: float
+    log_prob_threshold: Optional[float]
+    no_speech_threshold: Optional[float]
+    compression_ratio_threshold: Optional[float]
+    condition_on_previous_text: bool
+    temperatures: Sequence[float]
+    initial_prompt: Optional[str]
+    prefix: Optional[str]
+    suppress_blank: bool
+    suppress_tokens: Optional[List[int]]
+    without_timestamps: bool
+    max_initial_timestamp: float
+
+    # Frozen instances cannot be restored with setattr when copied or unpickled.
+    def __getstate__(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __setstate__(self, state):
+        for name, value in zip(self.__slots__, state):
+            object.__setattr__(self, name, value)
 
 
 class WhisperModel:
@@ -69,6 +94,8 @@ class WhisperModel:
             when transcribe() is called from multiple Python threads (see also num_workers).
           compute_type: Type to use for computation.
             See https://opennmt.net/CTranslate2/quantization.html.
+            By default, the model runs with 8-bit quantization when the device
+            supports it ("int8" on CPU and "int8_float16" on GPU).
           cpu_threads: Number of threads to use when running on CPU (4 by default).
             A non zero value overrides the OMP_NUM_THREADS environment variable.
           num_workers: When transcribe() is called from multiple Python threads,
@@ -76,6 +103,9 @@ class WhisperModel:
             (concurrent calls to self.model.generate() will run in parallel).
             This can improve the global throughput at the cost of increased memory usage.
         """
+        if compute_type == "default":
+            compute_type = get_default_compute_type(device, device_index)
+
         self.model = ctranslate2.models.Whisper(
             model_path,
             device=device,
@@ -97,6 +127,19 @@ class WhisperModel:
         self.input_stride = 2
         self.time_precision = 0.02
         self.max_length = 448
+        self.num_prefetched_windows = 4
+        self.generate_kwargs = dict(
+            max_length=self.max_length,
+            return_scores=True,
+            return_no_speech_prob=True,
+        )
+
+        # When the model runs in FP16 on GPU, the features are passed in FP16 which
+        # halves the size of the host to device copies.
+        if self.model.device == "cuda" and compute_type in ("float16", "int8_float16"):
+            self.input_dtype = np.float16
+        else:
+            self.input_dtype = np.float32
 
     def transcribe(
         self,
@@ -125,6 +168,7 @@ class WhisperModel:
         suppress_tokens: Optional[List[int]] = [-1],
         without_timestamps: bool = False,
         max_initial_timestamp: float = 1.0,
+        chunk_parallelism: int = 1,
     ):
         """Transcribes an input file.
 
@@ -159,6 +203,14 @@ class WhisperModel:
             of symbols as defined in the model config.json file.
           without_timestamps: Only sample text tokens.
           max_initial_timestamp: The initial timestamp cannot be later than this.
+          chunk_parallelism: Number of audio chunks to transcribe in parallel. The audio is
+            split into this number of chunks that are transcribed independently, so the
+            previous text is not used as a prompt across chunk boundaries. The chunks can
+            only run in parallel when the model is created with num_workers > 1.
+            The chunks are cut on 30-second boundaries without overlap: a word spoken
+            across a boundary can be truncated or missed. Overlapping chunks are not used
+            because the segments transcribed twice in the overlap generally have different
+            boundaries and text, so they cannot be reliably de-duplicated.
 
         Returns:
           A tuple with:
@@ -173,14 +225,16 @@ class WhisperModel:
 
         features = self.feature_extractor(audio)
 
+        encoder_output = None
+
         if language is None:
             if not self.model.is_multilingual:
                 language = "en"
                 language_probability = 1
             else:
                 segment = features[:, : self.feature_extractor.nb_max_frames]
-                input = get_input(segment)
-                results = self.model.detect_language(input)
+                encoder_output = self.encode(get_input(segment, self.input_dtype))
+                results = self.model.detect_language(encoder_output)
                 language_token, language_probability = results[0][0]
                 language = language_token[2:-2]
         else:
@@ -213,7 +267,14 @@ class WhisperModel:
             max_initial_timestamp=max_initial_timestamp,
         )
 
-        segments = self.generate_segments(features, tokenizer, options)
+        if chunk_parallelism > 1:
+            segments = self.generate_segments_in_parallel(
+                features, tokenizer, options, chunk_parallelism, encoder_output
+            )
+        else:
+            segments = self.generate_segments(
+                features, tokenizer, options, encoder_output
+            )
 
         audio_info = AudioInfo(
             language=language,
@@ -222,26 +283,96 @@ class WhisperModel:
 
         return segments, audio_info
 
-    def generate_segments(self, features, tokenizer, options):
+    def generate_segments_in_parallel(
+        self, features, tokenizer, options, num_chunks, encoder_output=None
+    ):
+        nb_max_frames = self.feature_extractor.nb_max_frames
+        content_frames = features.shape[-1] - nb_max_frames
+        if content_frames <= 0:
+            return
+
+        num_windows = -(-content_frames // nb_max_frames)
+        chunk_frames = -(-num_windows // num_chunks) * nb_max_frames
+
+        # The last frames correspond to the padding which is appended to each chunk.
+        padding = features[:, content_frames:]
+
+        def transcribe_chunk(start, options, encoder_output):
+            end = min(start + chunk_frames, content_frames)
+            chunk = np.concatenate([features[:, start:end], padding], axis=1)
+            time_offset = start * self.feature_extractor.time_per_frame
+
+            return [
+                segment._replace(
+                    start=segment.start + time_offset,
+                    end=segment.end + time_offset,
+                )
+                for segment in self.generate_segments(
+                    chunk, tokenizer, options, encoder_output
+                )
+            ]
+
+        # The initial prompt and prefix only apply to the first chunk.
+        chunk_options = dataclasses.replace(options, initial_prompt=None, prefix=None)
+
+        with concurrent.futures.ThreadPoolExecutor(num_chunks) as executor:
+            futures = []
+
+            for start in range(0, content_frames, chunk_frames):
+                if start == 0:
+                    future = executor.submit(
+                        transcribe_chunk, start, options, encoder_output
+                    )
+                else:
+                    future = executor.submit(
+                        transcribe_chunk, start, chunk_options, None
+                    )
+                futures.append(future)
+
+            for future in futures:
+                yield from future.result()
+
+    def generate_segments(self, features, tokenizer, options, encoder_output=None):
         content_frames = features.shape[-1] - self.feature_extractor.nb_max_frames
         seek = 0
-        all_tokens = []
-        prompt_reset_since = 0
+        previous_seek = None
+        num_full_advances = 0
+
+        # The next windows can only be encoded in advance on CPU: on GPU the batched
+        # encoder output would have to be copied to the host to be split per window.
+        if self.model.device == "cpu":
+            max_prefetched_windows = self.num_prefetched_windows
+        else:
+            max_prefetched_windows = 1
+
+        # The first window could already be encoded to detect the language.
+        encoder_outputs = {0: encoder_output} if encoder_output is not None else {}
+
+        # Only the most recent tokens can be included in the prompt.
+        previous_tokens = collections.deque(maxlen=self.max_length // 2 - 1)
+
+        # The input windows are copied into the same buffer for all encoder calls.
+        input_buffer = np.empty(
+            (
+                max_prefetched_windows,
+                features.shape[0],
+                self.feature_extractor.nb_max_frames,
+            ),
+            dtype=self.input_dtype,
+        )
 
         if options.initial_prompt is not None:
             initial_prompt = " " + options.initial_prompt.strip()
             initial_prompt_tokens = tokenizer.encode(initial_prompt)
-            all_tokens.extend(initial_prompt_tokens)
+            previous_tokens.extend(initial_prompt_tokens)
 
         while seek < content_frames:
             time_offset = seek * self.feature_extractor.time_per_frame
-            segment = features[:, seek : seek + self.feature_extractor.nb_max_frames]
             segment_size = min(
                 self.feature_extractor.nb_max_frames, content_frames - seek
             )
             segment_duration = segment_size * self.feature_extractor.time_per_frame
 
-            previous_tokens = all_tokens[prompt_reset_since:]
             prompt = self.get_prompt(
                 tokenizer,
                 previous_tokens,
@@ -249,8 +380,46 @@ class WhisperModel:
                 prefix=options.prefix,
             )
 
-            result, avg_log_prob, temperature = self.generate_with_fallback(
-                segment, prompt, tokenizer, options
+            if (
+                previous_seek is not None
+                and seek - previous_seek == self.feature_extractor.nb_max_frames
+            ):
+                num_full_advances += 1
+            else:
+                num_full_advances = 0
+
+            encoder_output = encoder_outputs.pop(seek, None)
+            if encoder_output is None:
+                # The next windows are encoded in a single batch only when they are
+                # expected to start on window boundaries: without timestamps, or after
+                # several windows that were fully consumed.
+                if options.without_timestamps or num_full_advances >= 2:
+                    num_windows = max_prefetched_windows
+                else:
+                    num_windows = 1
+
+                encoder_outputs = self.encode_windows(
+                    features, seek, content_frames, num_windows, input_buffer
+                )
+                encoder_output = encoder_outputs.pop(seek)
+
+            previous_seek = seek
+
+            if (
+                options.no_speech_threshold is not None
+                and options.log_prob_threshold is None
+            ):
+                # Without a log probability threshold, the no_speech probability alone
+                # decides whether the window is silent so it is checked before decoding.
+                no_speech_prob = self.get_no_speech_prob(encoder_output, prompt)
+
+                if no_speech_prob > options.no_speech_threshold:
+                    # fast-forward to the next segment boundary
+                    seek += segment_size
+                    continue
+
+            result, tokens, avg_log_prob, temperature = self.generate_with_fallback(
+                encoder_output, prompt, tokenizer, options
             )
 
             if options.no_speech_threshold is not None:
@@ -269,83 +438,78 @@ class WhisperModel:
                     seek += segment_size
                     continue
 
-            tokens = result.sequences_ids[0]
-
             current_segments = []
 
+            # The timestamp tokens and their positions are derived once from the tokens.
+            is_timestamp = tokens >= tokenizer.timestamp_begin
+            timestamp_positions = tokens - tokenizer.timestamp_begin
+
             single_timestamp_ending = (
-                len(tokens) >= 2
-                and tokens[-2] < tokenizer.timestamp_begin
-                and tokens[-1] >= tokenizer.timestamp_begin
+                len(tokens) >= 2 and not is_timestamp[-2] and is_timestamp[-1]
             )
 
-            consecutive_timestamps = [
-                i
-                for i in range(len(tokens))
-                if i > 0
-                and tokens[i] >= tokenizer.timestamp_begin
-                and tokens[i - 1] >= tokenizer.timestamp_begin
-            ]
+            consecutive_timestamps = (
+                np.nonzero(is_timestamp[1:] & is_timestamp[:-1])[0] + 1
+            )
 
             if len(consecutive_timestamps) > 0:
-                slices = list(consecutive_timestamps)
+                slices = consecutive_timestamps.tolist()
                 if single_timestamp_ending:
                     slices.append(len(tokens))
 
-                last_slice = 0
-                for current_slice in slices:
-                    sliced_tokens = tokens[last_slice:current_slice]
-                    start_timestamp_position = (
-                        sliced_tokens[0] - tokenizer.timestamp_begin
-                    )
-                    end_timestamp_position = (
-                        sliced_tokens[-1] - tokenizer.timestamp_begin
-                    )
-                    start_time = (
-                        time_offset + start_timestamp_position * self.time_precision
-                    )
-                    end_time = (
-                        time_offset + end_timestamp_position * self.time_precision
-                    )
+                slice_starts = [0] + slices[:-1]
+                start_positions = timestamp_positions[slice_starts].tolist()
+                end_positions = timestamp_positions[np.array(slices) - 1].tolist()
+
+                for last_slice, current_slice, start_position, end_position in zip(
+                    slice_starts, slices, start_positions, end_positions
+                ):
+                    start_time = time_offset + start_position * self.time_precision
+                    end_time = time_offset + end_position * self.time_precision
 
                     current_segments.append(
-                        dict(start=start_time, end=end_time, tokens=sliced_tokens)
+                        dict(
+                            start=start_time,
+                            end=end_time,
+                            tokens=tokens[last_slice:current_slice].tolist(),
+                        )
                     )
-                    last_slice = current_slice
 
                 if single_timestamp_ending:
                     # single timestamp at the end means no speech after the last timestamp.
                     seek += segment_size
                 else:
                     # otherwise, ignore the unfinished segment and seek to the last timestamp
-                    last_timestamp_position = (
-                        tokens[last_slice - 1] - tokenizer.timestamp_begin
-                    )
+                    last_timestamp_position = end_positions[-1]
                     seek += last_timestamp_position * self.input_stride
 
             else:
                 duration = segment_duration
-                timestamps = [
-                    token for token in tokens if token >= tokenizer.timestamp_begin
-                ]
-                if len(timestamps) > 0 and timestamps[-1] != tokenizer.timestamp_begin:
-                    last_timestamp_position = timestamps[-1] - tokenizer.timestamp_begin
+                timestamps = timestamp_positions[is_timestamp]
+                if len(timestamps) > 0 and timestamps[-1] != 0:
+                    last_timestamp_position = int(timestamps[-1])
                     duration = last_timestamp_position * self.time_precision
 
                 current_segments.append(
-                    dict(start=time_offset, end=time_offset + duration, tokens=tokens)
+                    dict(
+                        start=time_offset,
+                        end=time_offset + duration,
+                        tokens=tokens.tolist(),
+                    )
                 )
 
                 seek += segment_size
 
             if not options.condition_on_previous_text or temperature > 0.5:
-                prompt_reset_since = len(all_tokens)
+                previous_tokens.clear()
+
+            texts = tokenizer.decode_batch(
+                [segment["tokens"] for segment in current_segments]
+            )
 
-            for segment in current_segments:
-                tokens = segment["tokens"]
-                all_tokens.extend(tokens)
+            for segment, text in zip(current_segments, texts):
+                previous_tokens.extend(segment["tokens"])
 
-                text = tokenizer.decode(tokens)
                 if not text.strip():
                     continue
 
@@ -355,8 +519,50 @@ class WhisperModel:
                     text=text,
                 )
 
-    def generate_with_fallback(self, segment, prompt, tokenizer, options):
-        features = get_input(segment)
+    def encode(self, features):
+        # When the model is running on multiple GPUs, the encoder output should be moved
+        # to the CPU since we don't know which GPU will handle the next job.
+        to_cpu = self.model.device == "cuda" and len(self.model.device_index) > 1
+
+        return self.model.encode(features, to_cpu=to_cpu)
+
+    def encode_windows(self, features, seek, content_frames, num_windows, input_buffer):
+        nb_max_frames = self.feature_extractor.nb_max_frames
+        offsets = range(
+            seek,
+            min(seek + num_windows * nb_max_frames, content_frames),
+            nb_max_frames,
+        )
+
+        batch = input_buffer[: len(offsets)]
+        for i, offset in enumerate(offsets):
+            batch[i] = features[:, offset : offset + nb_max_frames]
+        batch = ctranslate2.StorageView.from_array(batch)
+
+        if len(offsets) == 1:
+            return {seek: self.encode(batch)}
+
+        # The batch is only encoded on CPU so the output can be split per window.
+        encoder_output = np.asarray(self.model.encode(batch))
+
+        return {
+            offset: ctranslate2.StorageView.from_array(encoder_output[i : i + 1])
+            for i, offset in enumerate(offsets)
+        }
+
+    def get_no_speech_prob(self, encoder_output, prompt):
+        # The no_speech probability is computed in the first decoding step.
+        result = self.model.generate(
+            encoder_output,
+            [prompt],
+            beam_size=1,
+            max_length=1,
+            return_no_speech_prob=True,
+        )[0]
+
+        return result.no_speech_prob
+
+    def generate_with_fallback(self, encoder_output, prompt, tokenizer, options):
         result = None
         avg_log_prob = None
         final_temperature = None
@@ -365,33 +571,34 @@ class WhisperModel:
             round(options.max_initial_timestamp / self.time_precision)
         )
 
+        # The arguments that do not depend on the temperature are only built once.
+        generate_kwargs = dict(
+            self.generate_kwargs,
+            length_penalty=options.length_penalty,
+            suppress_blank=options.suppress_blank,
+            suppress_tokens=options.suppress_tokens,
+            max_initial_timestamp_index=max_initial_timestamp_index,
+        )
+        beam_search_kwargs = dict(
+            generate_kwargs,
+            beam_size=options.beam_size,
+            patience=options.patience,
+        )
+
         for temperature in options.temperatures:
             if temperature > 0:
-                kwargs = {
-                    "beam_size": 1,
-                    "num_hypotheses": options.best_of,
-                    "sampling_topk": 0,
-                    "sampling_temperature": temperature,
-                }
+                kwargs = dict(
+                    generate_kwargs,
+                    beam_size=1,
+                    num_hypotheses=options.best_of,
+                    sampling_topk=0,
+                    sampling_temperature=temperature,
+                )
             else:
-                kwargs = {
-                    "beam_size": options.beam_size,
-                    "patience": options.patience,
-                }
+                kwargs = beam_search_kwargs
 
             final_temperature = temperature
-            result = self.model.generate(
-                features,
-                [prompt],
-                length_penalty=options.length_penalty,
-                max_length=self.max_length,
-                return_scores=True,
-                return_no_speech_prob=True,
-                suppress_blank=options.suppress_blank,
-                suppress_tokens=options.suppress_tokens,
-                max_initial_timestamp_index=max_initial_timestamp_index,
-                **kwargs,
-            )[0]
+            result = self.model.generate(encoder_output, [prompt], **kwargs)[0]
 
             tokens = result.sequences_ids[0]
 
@@ -400,27 +607,29 @@ class WhisperModel:
             cum_log_prob = result.scores[0] * (seq_len**options.length_penalty)
             avg_log_prob = cum_log_prob / (seq_len + 1)
 
-            text = tokenizer.decode(tokens).strip()
-            compression_ratio = get_compression_ratio(text)
-
             needs_fallback = False
 
-            if (
-                options.compression_ratio_threshold is not None
-                and compression_ratio > options.compression_ratio_threshold
-            ):
-                needs_fallback = True  # too repetitive
-
             if (
                 options.log_prob_threshold is not None
                 and avg_log_prob < options.log_prob_threshold
             ):
                 needs_fallback = True  # average log probability is too low
 
+            # The text is only decoded when the compression ratio can change the outcome.
+            if options.compression_ratio_threshold is not None and not needs_fallback:
+                text = tokenizer.decode(tokens).strip()
+                compression_ratio = get_compression_ratio(text)
+
+                if compression_ratio > options.compression_ratio_threshold:
+                    needs_fallback = True  # too repetitive
+
             if not needs_fallback:
                 break
 
-        return result, avg_log_prob, final_temperature
+        # The final tokens are converted once to an array for the timestamp processing.
+        tokens = np.asarray(result.sequences_ids[0], dtype=np.int32)
+
+        return result, tokens, avg_log_prob, final_temperature
 
     def get_prompt(
         self,
@@ -433,7 +642,7 @@ class WhisperModel:
 
         if previous_tokens:
             prompt.append(tokenizer.sot_prev)
-            prompt.extend(previous_tokens[-(self.max_length // 2 - 1) :])
+            prompt.extend(previous_tokens)
 
         prompt.extend(tokenizer.sot_sequence)
 
@@ -449,13 +658,44 @@ class WhisperModel:
         return prompt
 
 
-def get_input(segment):
-    segment = np.ascontiguousarray(segment)
-    segment = np.expand_dims(segment, 0)
-    segment = ctranslate2.StorageView.from_array(segment)
-    return segment
+def get_default_compute_type(device, device_index=0):
+    if device == "auto":
+        device = "cuda" if ctranslate2.get_cuda_device_count() > 0 else "cpu"
+
+    if isinstance(device_index, (list, tuple)):
+        device_index = device_index[0]
+
+    compute_type = "int8_float16" if device == "cuda" else "int8"
+    supported_compute_types = ctranslate2.get_supported_compute_types(
+        device, device_index
+    )
+
+    if compute_type not in supported_compute_types:
+        compute_type = "default"
+
+    return compute_type
+
+
+def get_input(segment, dtype=np.float32):
+    # A window sliced from the features is strided along the mel dimension and must be
+    # copied, but inputs that are already contiguous with the expected type are passed
+    # without a copy.
+    segment = segment.astype(dtype, order="C", copy=False)
+    return ctranslate2.StorageView.from_array(segment[np.newaxis])
 
 
 def get_compression_ratio(text):
+    # The default compression_ratio_threshold is calibrated on the zlib compression ratio
+    # (as in openai/whisper) so a different repetition measure cannot be swapped in here.
     text_bytes = text.encode("utf-8")
-    return len(text_bytes) / len(zlib.compress(text_bytes))
+
+    # With a 4KB window, deflate produces the same output size as with the default 32KB
+    # window for inputs within the maximum match distance (window size - 262 bytes),
+    # but the compressor is about twice as fast to initialize.
+    if len(text_bytes) <= 4096 - 262:
+        compressor = zlib.compressobj(wbits=12)
+        compressed_size = len(compressor.compress(text_bytes)) + len(compressor.flush())
+    else:
+        compressed_size = len(zlib.compress(text_bytes))
+
+    return len(text_bytes) / compressed_size